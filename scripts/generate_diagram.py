@@ -4,42 +4,91 @@ Alternative WaveDrom diagram generator using wavedrom Python package.
 Use this if wavedrom-cli has issues.
 """
 
-import json
+import hashlib
+import io
+import os
 import sys
 from pathlib import Path
-import glob
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from importlib.metadata import PackageNotFoundError, version
 
 try:
     import wavedrom
-    from cairosvg import svg2png
 except ImportError:
     print("ERROR: Required packages not installed.")
-    print("Install with: pip3 install wavedrom cairosvg")
+    print("Install with: pip3 install wavedrom")
     sys.exit(1)
 
+# PNG output is opt-in (set BUILD_PNG=1); it needs cairosvg and is the slowest step
+BUILD_PNG = os.environ.get('BUILD_PNG', '').strip().lower() in ('1', 'true', 'yes', 'on')
 
-def generate_diagram(json_file: str, output_svg: str, output_png: str = None):
-    """Generate SVG and optionally PNG from WaveDrom JSON."""
+# Part of the cache key, so a renderer upgrade forces a rebuild
+try:
+    WAVEDROM_VERSION = version('wavedrom')
+except PackageNotFoundError:
+    WAVEDROM_VERSION = 'unknown'
+
+# cairosvg's svg2png, imported once per process on first use
+_svg2png = None
+
+
+def _load_svg2png():
+    """Import cairosvg once; raises ImportError/OSError if it or libcairo is missing."""
+    global _svg2png
+    if _svg2png is None:
+        from cairosvg import svg2png
+        _svg2png = svg2png
+    return _svg2png
+
+
+# Tiny SVG with text, so the warm-up render goes through cairo's font selection
+# (and thus the fontconfig scan) the way WaveDrom diagram labels do
+_PRIME_SVG = (b'<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16">'
+              b'<text x="0" y="12" font-family="Helvetica" font-size="11">0</text></svg>')
+
+
+def _prime_cairosvg():
+    """Worker initializer: import cairosvg and load fonts once per process."""
+    try:
+        _load_svg2png()(bytestring=_PRIME_SVG)
+    except (ImportError, OSError):
+        pass  # cairosvg/libcairo missing; reported per diagram by generate_diagram
+
+
+def generate_diagram(json_file: str, output_svg: str, output_png: str = None,
+                     source: str = None):
+    """Generate SVG and optionally PNG from WaveDrom JSON.
     
-    # Load JSON
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+    Pass source to render JSON text the caller has already read from json_file.
+    """
+    if source is None:
+        source = Path(json_file).read_text(encoding='utf-8')
     
-    # Generate SVG (returns Drawing object)
-    drawing = wavedrom.render(json.dumps(data))
+    # Generate SVG (returns Drawing object); wavedrom parses the JSON source itself
+    drawing = wavedrom.render(source)
+    
+    # Serialize once (same output as saveas) and reuse the text for the PNG
+    buffer = io.StringIO()
+    drawing.write(buffer)
+    svg_text = buffer.getvalue()
     
     # Save SVG
-    drawing.saveas(output_svg)
+    Path(output_svg).write_text(svg_text, encoding='utf-8')
     print(f"✓ Generated SVG: {output_svg}")
     
     # Generate PNG if requested
     if output_png:
         try:
-            # Read the SVG file we just created
-            with open(output_svg, 'rb') as f:
-                svg_data = f.read()
-            
-            svg2png(bytestring=svg_data, 
+            svg2png = _load_svg2png()
+        except (ImportError, OSError) as e:
+            print(f"⚠ PNG generation skipped: cairosvg unavailable ({e})")
+            print("  Install with: pip3 install cairosvg (SVG is still available)")
+            return
+        
+        try:
+            # Rasterize the in-memory SVG instead of reading the file back
+            svg2png(bytestring=svg_text.encode('utf-8'),
                     write_to=output_png,
                     scale=3.0)  # 3x scale for better quality
             print(f"✓ Generated PNG: {output_png}")
@@ -48,12 +97,36 @@ def generate_diagram(json_file: str, output_svg: str, output_png: str = None):
             print("  (SVG is still available)")
 
 
+def _generate_one(json_file: str, docs_dir: str, build_dir: str):
+    """Worker: generate SVG (and PNG if BUILD_PNG is set) for a single WaveDrom JSON file."""
+    basename = Path(json_file).stem
+    svg_file = f"{docs_dir}/{basename}.svg"
+    png_file = f"{build_dir}/{basename}.png" if BUILD_PNG else None
+    
+    # Skip rendering if the JSON source is unchanged since the last build
+    data = Path(json_file).read_bytes()
+    digest = hashlib.sha256(WAVEDROM_VERSION.encode() + b'\0' + data).hexdigest()
+    stamp = Path(f"{build_dir}/{basename}.svg.sha")
+    if (stamp.exists() and stamp.read_text().strip() == digest
+            and Path(svg_file).exists() and (png_file is None or Path(png_file).exists())):
+        print(f"\n✓ {basename} is up to date")
+        return
+    
+    print(f"\nProcessing {basename}...")
+    generate_diagram(json_file, svg_file, png_file, source=data.decode('utf-8'))
+    stamp.write_text(digest)
+
+
 def generate_all_diagrams(docs_dir: str, build_dir: str):
     """Generate all timing diagrams from docs directory."""
     
     # Find all timing diagram JSON files
-    pattern = f"{docs_dir}/timing_diagram*.json"
-    json_files = glob.glob(pattern)
+    try:
+        with os.scandir(docs_dir) as entries:
+            json_files = sorted(e.path for e in entries
+                                if e.name.startswith('timing_diagram') and e.name.endswith('.json'))
+    except OSError:  # Missing or not a directory, same as an empty glob
+        json_files = []
     
     if not json_files:
         print(f"ERROR: No timing diagram files found in {docs_dir}")
@@ -61,13 +134,13 @@ def generate_all_diagrams(docs_dir: str, build_dir: str):
     
     print(f"Found {len(json_files)} diagram(s) to generate:")
     
-    for json_file in sorted(json_files):
-        basename = Path(json_file).stem
-        svg_file = f"{docs_dir}/{basename}.svg"
-        png_file = f"{build_dir}/{basename}.png"
-        
-        print(f"\nProcessing {basename}...")
-        generate_diagram(json_file, svg_file, png_file)
+    # Cache stamps live in build_dir so 'make clean' drops them
+    Path(build_dir).mkdir(exist_ok=True)
+    
+    # Diagrams are independent, render them in parallel worker processes
+    with ProcessPoolExecutor(initializer=_prime_cairosvg if BUILD_PNG else None) as executor:
+        list(executor.map(partial(_generate_one, docs_dir=docs_dir, build_dir=build_dir),
+                          json_files))
     
     print(f"\n✓ All diagrams generated successfully!")
 